@@ -0,0 +1,309 @@
+#!/bin/python3
+"""
+Mattermost Update Notifier - Clustered checking
+
+Several main.py workers can share one state backend and split the configured
+instances between them. Every worker announces itself with a heartbeat from a
+background thread, and the live workers divide the instances by rendezvous
+(highest random weight) hashing. Before probing an instance a worker claims
+it for the current check interval with a time-limited lease, renews the lease
+before notifying and marks the claim done afterwards, so within one interval
+an instance is probed and notified by at most one worker. After its own share
+a worker picks up every instance that is still unclaimed in the interval
+(share of a dead or lagging worker) or whose lease has run out.
+"""
+
+import os
+import time
+import socket
+import sqlite3
+import hashlib
+import logging
+import threading
+from abc import ABC, abstractmethod
+
+CLUSTER_MODE = os.environ.get('CLUSTER_MODE', '').lower() in ('1', 'true', 'yes', 'on')
+CLUSTER_DB = os.environ.get('CLUSTER_DB', './data/cluster.db')
+
+# Must exceed the worst case for one instance: 3 attempts x 30 s timeout + 3 s backoff + 30 s notification
+try:
+    LEASE_TTL = int(os.environ['LEASE_TTL'])
+except:
+    LEASE_TTL = 300
+
+try:
+    HEARTBEAT_INTERVAL = int(os.environ['HEARTBEAT_INTERVAL'])
+except:
+    HEARTBEAT_INTERVAL = 30
+
+WORKER_ID = os.environ.get('WORKER_ID') or f'{socket.gethostname()}-{os.getpid()}'
+
+
+def slotFor(interval, now=None):
+    """Number of the check interval a timestamp falls into"""
+    if now is None:
+        now = time.time()
+    return int(now // max(interval, 1))
+
+
+def ownerOf(key, workers):
+    """Pick the worker responsible for an instance key (rendezvous hashing)"""
+    if not workers:
+        return None
+    def weight(worker):
+        return hashlib.sha1(f'{worker}:{key}'.encode('utf-8')).hexdigest()
+    return max(sorted(workers), key=weight)
+
+
+class LeaseStore(ABC):
+    """Interface of the shared state backend used by clustered workers"""
+
+    @abstractmethod
+    def heartbeat(self, worker, now):
+        pass
+
+    @abstractmethod
+    def liveWorkers(self, ttl, now):
+        pass
+
+    @abstractmethod
+    def claim(self, key, slot, worker, ttl, now):
+        """Claim an instance for one interval, True if this worker may probe it
+
+        Succeeds if the instance is unclaimed in the slot or its unfinished
+        lease has expired; a finished claim is never taken over.
+        """
+
+    @abstractmethod
+    def renew(self, key, slot, worker, ttl, now):
+        """Extend a lease, False if the worker no longer holds it"""
+
+    @abstractmethod
+    def complete(self, key, slot, worker):
+        pass
+
+    @abstractmethod
+    def release(self, worker):
+        pass
+
+    def prune(self, before_slot):
+        """Drop claims of old intervals so the store does not grow forever"""
+        pass
+
+
+class MemoryLeaseStore(LeaseStore):
+    """In-process stand-in for the shared store (single worker, tests)"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._workers = {}
+        self._claims = {}
+
+    def heartbeat(self, worker, now):
+        with self._lock:
+            self._workers[worker] = now
+
+    def liveWorkers(self, ttl, now):
+        with self._lock:
+            return sorted(w for w, seen in self._workers.items() if now - seen < ttl)
+
+    def claim(self, key, slot, worker, ttl, now):
+        with self._lock:
+            current = self._claims.get((key, slot))
+            if current is not None and (current['done'] or (current['owner'] != worker and current['expires'] > now)):
+                return False
+            self._claims[(key, slot)] = {'owner': worker, 'expires': now + ttl, 'done': False}
+            return True
+
+    def renew(self, key, slot, worker, ttl, now):
+        with self._lock:
+            current = self._claims.get((key, slot))
+            if current is None or current['owner'] != worker or current['done']:
+                return False
+            current['expires'] = now + ttl
+            return True
+
+    def complete(self, key, slot, worker):
+        with self._lock:
+            current = self._claims.get((key, slot))
+            if current and current['owner'] == worker:
+                current['done'] = True
+
+    def release(self, worker):
+        with self._lock:
+            self._workers.pop(worker, None)
+
+    def prune(self, before_slot):
+        with self._lock:
+            for claim in [c for c in self._claims if c[1] < before_slot]:
+                del self._claims[claim]
+
+
+class SQLiteLeaseStore(LeaseStore):
+    """Lease store backed by an SQLite file on a shared volume"""
+
+    def __init__(self, path=CLUSTER_DB):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._connect() as db:
+            db.execute('CREATE TABLE IF NOT EXISTS workers ('
+                       'worker TEXT PRIMARY KEY, last_seen REAL NOT NULL)')
+            db.execute('CREATE TABLE IF NOT EXISTS claims ('
+                       'instance TEXT NOT NULL, slot INTEGER NOT NULL, owner TEXT NOT NULL, '
+                       'expires REAL NOT NULL, done INTEGER NOT NULL DEFAULT 0, '
+                       'PRIMARY KEY (instance, slot))')
+
+    def _connect(self):
+        db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        db.execute('PRAGMA busy_timeout = 30000')
+        return _Transaction(db)
+
+    def heartbeat(self, worker, now):
+        with self._connect() as db:
+            db.execute('INSERT INTO workers (worker, last_seen) VALUES (?, ?) '
+                       'ON CONFLICT(worker) DO UPDATE SET last_seen = excluded.last_seen',
+                       (worker, now))
+
+    def liveWorkers(self, ttl, now):
+        with self._connect() as db:
+            rows = db.execute('SELECT worker FROM workers WHERE last_seen > ?', (now - ttl,)).fetchall()
+        return sorted(row[0] for row in rows)
+
+    def claim(self, key, slot, worker, ttl, now):
+        with self._connect() as db:
+            row = db.execute('SELECT owner, expires, done FROM claims WHERE instance = ? AND slot = ?',
+                             (key, slot)).fetchone()
+            if row is None:
+                db.execute('INSERT INTO claims (instance, slot, owner, expires) VALUES (?, ?, ?, ?)',
+                           (key, slot, worker, now + ttl))
+                return True
+            owner, expires, done = row
+            if done or (owner != worker and expires > now):
+                return False
+            db.execute('UPDATE claims SET owner = ?, expires = ? WHERE instance = ? AND slot = ?',
+                       (worker, now + ttl, key, slot))
+            return True
+
+    def renew(self, key, slot, worker, ttl, now):
+        with self._connect() as db:
+            cursor = db.execute('UPDATE claims SET expires = ? '
+                                'WHERE instance = ? AND slot = ? AND owner = ? AND done = 0',
+                                (now + ttl, key, slot, worker))
+            return cursor.rowcount == 1
+
+    def complete(self, key, slot, worker):
+        with self._connect() as db:
+            db.execute('UPDATE claims SET done = 1 WHERE instance = ? AND slot = ? AND owner = ?',
+                       (key, slot, worker))
+
+    def release(self, worker):
+        with self._connect() as db:
+            db.execute('DELETE FROM workers WHERE worker = ?', (worker,))
+
+    def prune(self, before_slot):
+        with self._connect() as db:
+            db.execute('DELETE FROM claims WHERE slot < ?', (before_slot,))
+
+
+class _Transaction:
+    """Run a block of statements in one IMMEDIATE transaction and close the connection"""
+
+    def __init__(self, db):
+        self.db = db
+
+    def __enter__(self):
+        self.db.execute('BEGIN IMMEDIATE')
+        return self.db
+
+    def __exit__(self, exc_type, exc, tb):
+        try:
+            self.db.execute('ROLLBACK' if exc_type else 'COMMIT')
+        finally:
+            self.db.close()
+        return False
+
+
+class Cluster:
+    """Per-instance leases of one worker for the current check interval"""
+
+    def __init__(self, store, interval, worker=WORKER_ID, ttl=LEASE_TTL,
+                 heartbeatInterval=HEARTBEAT_INTERVAL, clock=time.time):
+        self.store = store
+        self.interval = interval
+        self.worker = worker
+        self.ttl = ttl
+        self.heartbeatInterval = heartbeatInterval
+        self.clock = clock
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """Heartbeat from a background thread, independent of the check cycle"""
+        self.beat()
+        self._thread = threading.Thread(target=self._heartbeatLoop, name='cluster-heartbeat', daemon=True)
+        self._thread.start()
+
+    def _heartbeatLoop(self):
+        while not self._stop.wait(self.heartbeatInterval):
+            self.beat()
+
+    def beat(self):
+        try:
+            self.store.heartbeat(self.worker, self.clock())
+        except Exception as e:
+            logging.warning('⚠️ Cluster: heartbeat of worker %s failed: %s', self.worker, e)
+
+    def currentSlot(self):
+        return slotFor(self.interval, self.clock())
+
+    def nextSlotStart(self):
+        """Wall-clock time at which the next check interval begins"""
+        return (slotFor(self.interval, self.clock()) + 1) * self.interval
+
+    def plan(self, keys):
+        """Order the instance keys for this cycle: own hash share first, then all others
+
+        Returns the slot and the ordered keys. Keys of other workers are only
+        probed if they are still claimable when this worker gets to them.
+        """
+        now = self.clock()
+        slot = slotFor(self.interval, now)
+        self.beat()
+        # Three missed heartbeats mark a worker as dead
+        workers = self.store.liveWorkers(3 * self.heartbeatInterval, now)
+        if self.worker not in workers:
+            workers.append(self.worker)
+        own = [key for key in keys if ownerOf(key, workers) == self.worker]
+        ownSet = set(own)
+        others = [key for key in keys if key not in ownSet]
+        logging.info('🔗 Cluster: worker %s owns %d/%d instances (%d live workers, slot %d)',
+                     self.worker, len(own), len(keys), len(workers), slot)
+        self.store.prune(slot - 1)
+        return slot, own + others
+
+    def claim(self, key, slot):
+        return self.store.claim(key, slot, self.worker, self.ttl, self.clock())
+
+    def renew(self, key, slot):
+        # Once the interval has passed, a worker of the next interval may be probing the instance
+        if self.currentSlot() != slot:
+            return False
+        return self.store.renew(key, slot, self.worker, self.ttl, self.clock())
+
+    def complete(self, key, slot):
+        self.store.complete(key, slot, self.worker)
+
+    def shutdown(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+        self.store.release(self.worker)
+
+
+def createStore():
+    """Build the configured lease store"""
+    if CLUSTER_DB in ('', ':memory:', 'memory'):
+        return MemoryLeaseStore()
+    return SQLiteLeaseStore(CLUSTER_DB)
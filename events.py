@@ -0,0 +1,176 @@
+#!/bin/python3
+"""
+Mattermost Update Notifier - Probe event log
+
+The update checker appends every probe result and every state change of an
+instance (outdated, updated, reachable, unreachable) to an SQLite event log.
+The web interface streams this log to external consumers (see /api/stream in
+webapp.py), resuming from the id of the last event they have seen, so they do
+not have to poll /api/status. State changes can additionally be posted to an
+outbound webhook (EVENT_WEBHOOK_URL).
+"""
+
+import os
+import json
+import time
+import sqlite3
+import logging
+import requests
+
+EVENT_LOG = os.environ.get('EVENT_LOG', 'true').lower() not in ('0', 'false', 'no', 'off')
+EVENTS_DB = os.environ.get('EVENTS_DB', './data/events.db')
+EVENT_WEBHOOK_URL = os.environ.get('EVENT_WEBHOOK_URL', '')
+
+try:
+    EVENTS_RETENTION = int(os.environ['EVENTS_RETENTION'])
+except:
+    EVENTS_RETENTION = 100000
+
+# Probe outcome -> instance state
+STATES = {
+    'unreachable': 'unreachable',
+    'up_to_date': 'current',
+    'already_notified': 'outdated',
+    'notified': 'outdated',
+    'notify_failed': 'outdated',
+    'lease_lost': 'outdated',
+}
+
+
+def transitions(previous, reachable, outdated):
+    """Names of the state change events between two (reachable, outdated) states
+
+    Reachability and version are tracked separately: an instance that comes
+    back reports `reachable` and, only if its version changed meanwhile,
+    `outdated` or `updated`. The version of an unreachable instance is unknown,
+    so outdated is None for it and the previous flag is kept.
+    """
+    wasReachable, wasOutdated = previous
+    kinds = []
+    if reachable != wasReachable:
+        kinds.append('reachable' if reachable else 'unreachable')
+    if outdated is not None and outdated != wasOutdated:
+        kinds.append('outdated' if outdated else 'updated')
+    return kinds
+
+
+class EventStore:
+    """Append-only event log in an SQLite file shared by checker and web interface"""
+
+    def __init__(self, path=EVENTS_DB):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._connect() as db:
+            db.execute('CREATE TABLE IF NOT EXISTS events ('
+                       'id INTEGER PRIMARY KEY AUTOINCREMENT, ts REAL NOT NULL, '
+                       'kind TEXT NOT NULL, instance TEXT NOT NULL, data TEXT NOT NULL)')
+            db.execute('CREATE TABLE IF NOT EXISTS instance_status ('
+                       'instance TEXT PRIMARY KEY, reachable INTEGER NOT NULL, '
+                       'outdated INTEGER NOT NULL, version TEXT)')
+
+    def _connect(self):
+        db = sqlite3.connect(self.path, timeout=30)
+        db.execute('PRAGMA busy_timeout = 30000')
+        return _Closing(db)
+
+    def record(self, index, name, outcome, latency, installed=None, latest=None):
+        """Store a probe result; returns the state change events it caused"""
+        now = time.time()
+        state = STATES.get(outcome, 'unreachable')
+        reachable = state != 'unreachable'
+        outdated = state == 'outdated' if reachable else None
+        probe = {
+            'instance_id': index,
+            'outcome': outcome,
+            'state': state,
+            'version': installed,
+            'latest': latest,
+            'latency_ms': round(latency * 1000, 1),
+        }
+        changes = []
+        try:
+            with self._connect() as db:
+                self._append(db, now, 'probe', name, probe)
+                row = db.execute('SELECT reachable, outdated, version FROM instance_status WHERE instance = ?',
+                                 (name,)).fetchone()
+                # Instances seen for the first time count as reachable and current, so only problems are reported
+                wasReachable, wasOutdated, previousVersion = row if row else (True, False, None)
+                wasReachable, wasOutdated = bool(wasReachable), bool(wasOutdated)
+                for kind in transitions((wasReachable, wasOutdated), reachable, outdated):
+                    data = dict(probe, previous_reachable=wasReachable, previous_outdated=wasOutdated,
+                                previous_version=previousVersion)
+                    changes.append({'id': self._append(db, now, kind, name, data),
+                                    'ts': now, 'kind': kind, 'instance': name, 'data': data})
+                db.execute('INSERT INTO instance_status (instance, reachable, outdated, version) '
+                           'VALUES (?, ?, ?, ?) ON CONFLICT(instance) DO UPDATE SET '
+                           'reachable = excluded.reachable, outdated = excluded.outdated, '
+                           'version = COALESCE(excluded.version, instance_status.version)',
+                           (name, reachable, wasOutdated if outdated is None else outdated, installed))
+        except sqlite3.Error as e:
+            logging.warning('⚠️ Failed to record probe event for %s: %s', name, e)
+            return []
+
+        if EVENT_WEBHOOK_URL:
+            for change in changes:
+                postEvent(EVENT_WEBHOOK_URL, change)
+        return changes
+
+    def _append(self, db, now, kind, name, data):
+        cursor = db.execute('INSERT INTO events (ts, kind, instance, data) VALUES (?, ?, ?, ?)',
+                            (now, kind, name, json.dumps(data)))
+        return cursor.lastrowid
+
+    def read(self, cursor=0, limit=500, kinds=None):
+        """Events with an id greater than cursor, oldest first"""
+        query = 'SELECT id, ts, kind, instance, data FROM events WHERE id > ?'
+        params = [cursor]
+        if kinds:
+            query += ' AND kind IN (%s)' % ','.join('?' * len(kinds))
+            params += list(kinds)
+        query += ' ORDER BY id LIMIT ?'
+        params.append(limit)
+        with self._connect() as db:
+            rows = db.execute(query, params).fetchall()
+        return [{'id': row[0], 'ts': row[1], 'kind': row[2], 'instance': row[3], 'data': json.loads(row[4])}
+                for row in rows]
+
+    def prune(self, keep=EVENTS_RETENTION):
+        """Keep only the newest events"""
+        try:
+            with self._connect() as db:
+                db.execute('DELETE FROM events WHERE id <= (SELECT MAX(id) FROM events) - ?', (keep,))
+        except sqlite3.Error as e:
+            logging.warning('⚠️ Failed to prune event log: %s', e)
+
+
+class _Closing:
+    """Commit (or roll back) and close an SQLite connection at the end of a block"""
+
+    def __init__(self, db):
+        self.db = db
+
+    def __enter__(self):
+        return self.db
+
+    def __exit__(self, exc_type, exc, tb):
+        try:
+            if exc_type:
+                self.db.rollback()
+            else:
+                self.db.commit()
+        finally:
+            self.db.close()
+        return False
+
+
+def postEvent(url, event):
+    """Send a state change event to the outbound event webhook"""
+    try:
+        response = requests.post(url, json=event, timeout=10)
+        response.raise_for_status()
+        return response.status_code
+    except requests.exceptions.RequestException as e:
+        logging.warning('⚠️ Failed to post %s event for %s to event webhook: %s', event['kind'], event['instance'], e)
+        return None
@@ -0,0 +1,175 @@
+#!/bin/python3
+"""
+Mattermost Update Notifier - Structured logging
+
+With LOG_FORMAT=json every log record is written as one JSON object per line
+and each instance probe produces a single event carrying the instance, the
+probe latency, the version and the outcome. Repetitive success events can be
+sampled with LOG_SAMPLE_RATE. Records are handed to a background thread
+through a bounded queue, so a slow stdout never stalls the check loop; when
+the queue is full records are dropped and counted instead of blocking; the
+count is logged after every check cycle and at shutdown.
+"""
+
+import os
+import sys
+import copy
+import json
+import queue
+import atexit
+import random
+import logging
+import logging.handlers
+from datetime import datetime, timezone
+
+TEXT_FORMAT = '%(asctime)s %(levelname)-8s [%(filename)s:%(lineno)d] %(message)s'
+TEXT_DATEFMT = '%Y-%m-%d %H:%M:%S'
+
+LOG_FORMAT = os.environ.get('LOG_FORMAT', 'text').lower()
+
+try:
+    LOG_SAMPLE_RATE = min(max(float(os.environ['LOG_SAMPLE_RATE']), 0.0), 1.0)
+except:
+    LOG_SAMPLE_RATE = 1.0
+
+try:
+    LOG_QUEUE_SIZE = int(os.environ['LOG_QUEUE_SIZE'])
+except:
+    LOG_QUEUE_SIZE = 10000
+
+# Probe outcomes that repeat every cycle and are subject to sampling
+SAMPLED_OUTCOMES = ('up_to_date', 'already_notified')
+
+# Level of the per-instance narrative lines; in JSON mode the probe event replaces them
+DETAIL = logging.DEBUG if LOG_FORMAT == 'json' else logging.INFO
+
+probeLogger = logging.getLogger('probe')
+
+
+def structured():
+    return LOG_FORMAT == 'json'
+
+
+class JsonFormatter(logging.Formatter):
+    """Render a log record as a single JSON line"""
+
+    def format(self, record):
+        event = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage(),
+        }
+        if hasattr(record, 'probe'):
+            event.update(record.probe)
+        else:
+            event['src'] = f'{record.filename}:{record.lineno}'
+        # exc_info is already rendered to exc_text by DroppingQueueHandler.prepare
+        if record.exc_text:
+            event['exc'] = record.exc_text
+        return json.dumps(event, ensure_ascii=False, default=str)
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """Queue handler that drops records instead of blocking when the queue is full"""
+
+    def __init__(self, q):
+        super().__init__(q)
+        self.dropped = 0
+
+    def prepare(self, record):
+        """Like QueueHandler.prepare, but keep the traceback as exc_text instead of merging it into msg"""
+        record = copy.copy(record)
+        if record.exc_info and not record.exc_text:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+        record.msg = record.getMessage()
+        record.args = None
+        record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def takeDropped(self):
+        """Number of records dropped since the last call"""
+        self.acquire()
+        try:
+            dropped, self.dropped = self.dropped, 0
+        finally:
+            self.release()
+        return dropped
+
+
+class DrainingQueueListener(logging.handlers.QueueListener):
+    """Queue listener whose stop() waits for room in a full queue instead of failing"""
+
+    def enqueue_sentinel(self):
+        self.queue.put(self._sentinel)
+
+
+_handler = None
+
+
+def reportDropped():
+    """Log how many records were dropped because the queue was full (JSON mode, once per cycle)"""
+    dropped = _handler.takeDropped() if _handler else 0
+    if dropped:
+        logging.warning('⚠️ %d log records dropped, log queue full (LOG_QUEUE_SIZE=%d)', dropped, LOG_QUEUE_SIZE)
+    return dropped
+
+
+def _shutdown(listener):
+    """Drain the queue, then write the final dropped count directly to the output"""
+    listener.stop()
+    dropped = _handler.takeDropped()
+    if dropped:
+        record = logging.getLogger().makeRecord(
+            'root', logging.WARNING, __file__, 0,
+            '⚠️ %d log records dropped, log queue full (LOG_QUEUE_SIZE=%d)', (dropped, LOG_QUEUE_SIZE), None)
+        for output in listener.handlers:
+            output.handle(record)
+
+
+def setupLogging(level=logging.INFO):
+    """Configure the root logger; returns the queue listener (None in text mode)"""
+    global _handler
+    if not structured():
+        logging.basicConfig(format=TEXT_FORMAT, level=level, datefmt=TEXT_DATEFMT)
+        return None
+
+    output = logging.StreamHandler(sys.stdout)
+    output.setFormatter(JsonFormatter())
+    handler = DroppingQueueHandler(queue.Queue(maxsize=LOG_QUEUE_SIZE))
+    listener = DrainingQueueListener(handler.queue, output, respect_handler_level=False)
+
+    root = logging.getLogger()
+    for existing in root.handlers[:]:
+        root.removeHandler(existing)
+    root.addHandler(handler)
+    root.setLevel(level)
+    _handler = handler
+
+    listener.start()
+    atexit.register(_shutdown, listener)
+    return listener
+
+
+def logProbe(index, name, outcome, latency, installed=None, latest=None):
+    """Emit the structured event for one instance probe (JSON mode only)"""
+    if not structured() or not probeLogger.isEnabledFor(logging.INFO):
+        return
+    if outcome in SAMPLED_OUTCOMES and LOG_SAMPLE_RATE < 1.0 and random.random() >= LOG_SAMPLE_RATE:
+        return
+    probeLogger.info('probe', extra={'probe': {
+        'event': 'probe',
+        'instance_id': index,
+        'instance': name,
+        'outcome': outcome,
+        'latency_ms': round(latency * 1000, 1),
+        'version': installed,
+        'latest': latest,
+        'sample_rate': LOG_SAMPLE_RATE if outcome in SAMPLED_OUTCOMES else 1.0,
+    }})
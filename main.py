@@ -9,12 +9,30 @@ import os
 from os.path import exists
 from requests_html import HTMLSession
 from packaging import version
+from dotenv import load_dotenv
+
+# Load config.env before the modules below, they read their settings on import
+load_dotenv('config.env')
+
+import cluster
+import jsonlog
+import events
+import tracing
 
 try:
     INTERVAL = int(os.environ['CHECKINVERVAL']) 
 except:
     INTERVAL = 1800
 
+RELEASES_URL = os.environ.get('RELEASES_URL', 'https://releases.mattermost.com')
+
+# Set in __main__ when CLUSTER_MODE is enabled
+CLUSTER = None
+# Set in __main__ when EVENT_LOG is enabled
+EVENTS = None
+# Set by the trace trigger in cluster mode: trace the next scheduled cycle
+TRACE_NEXT_CYCLE = False
+
 def readinstances():
     try:
         with open('./data/instances.json', 'r') as f:
@@ -55,80 +73,95 @@ def getInstanceVersion(apiUrl, max_retries=3):
     
     for attempt in range(max_retries):
         try:
-            response = requests.get(apiUrl, timeout=30)
+            with tracing.span('http_get', 'http', attempt=attempt + 1):
+                response = requests.get(apiUrl, timeout=30)
+                tracing.requestSpans(response, status=response.status_code)
             response.raise_for_status()  # Raise exception for HTTP errors
             data = response.json()
             if 'Version' in data:
                 version = data['Version']
                 if attempt > 0:
-                    logging.info(f'✅ Successfully retrieved version from {apiUrl} on attempt {attempt + 1}')
+                    logging.log(jsonlog.DETAIL, '✅ Successfully retrieved version from %s on attempt %d', apiUrl, attempt + 1)
                 break
             else:
-                logging.warning(f'❌ Version field not found in API response from {apiUrl}')
+                logging.warning('❌ Version field not found in API response from %s', apiUrl)
                 break
         except requests.exceptions.RequestException as e:
             if attempt < max_retries - 1:
-                logging.warning(f'⚠️ Attempt {attempt + 1} failed for {apiUrl}: {str(e)}, retrying...')
-                time.sleep(2 ** attempt)  # Exponential backoff
+                logging.warning('⚠️ Attempt %d failed for %s: %s, retrying...', attempt + 1, apiUrl, e)
+                with tracing.span('backoff', 'retry', seconds=2 ** attempt):
+                    time.sleep(2 ** attempt)  # Exponential backoff
             else:
-                logging.warning(f'❌ Failed to read instance version from api {apiUrl} after {max_retries} attempts: {str(e)}')
+                logging.warning('❌ Failed to read instance version from api %s after %d attempts: %s', apiUrl, max_retries, e)
         except (ValueError, KeyError) as e:
-            logging.warning(f'❌ Failed to parse API response from {apiUrl}: {str(e)}')
+            logging.warning('❌ Failed to parse API response from %s: %s', apiUrl, e)
             break
         except Exception as e:
-            logging.warning(f'❌ Unexpected error reading instance version from {apiUrl}: {str(e)}')
+            logging.warning('❌ Unexpected error reading instance version from %s: %s', apiUrl, e)
             break
     
     return version
 
-def getLatestVersion(max_retries=3):
-    downloadUrl = ""
-    version = ""
-
+def fetchReleasesPage(session, max_retries=3):
     for attempt in range(max_retries):
-        session = HTMLSession()
         try:
-            r = session.get('https://releases.mattermost.com', timeout=30)
+            with tracing.span('http_get', 'http', attempt=attempt + 1):
+                r = session.get(RELEASES_URL, timeout=30)
+                tracing.requestSpans(r, status=r.status_code)
             r.raise_for_status()
-            htmlPageText = r.text
-            break
+            return r.text
         except requests.exceptions.RequestException as e:
             if attempt < max_retries - 1:
                 logging.warning(f'⚠️ Attempt {attempt + 1} failed to get latest version from Mattermost website: {str(e)}, retrying...')
-                time.sleep(2 ** attempt)  # Exponential backoff
+                with tracing.span('backoff', 'retry', seconds=2 ** attempt):
+                    time.sleep(2 ** attempt)  # Exponential backoff
             else:
                 logging.warning(f'❌ Failed to get latest version from Mattermost website after {max_retries} attempts: {str(e)}')
-                return "", ""
         except Exception as e:
             logging.warning(f'❌ Unexpected error getting latest version: {str(e)}')
-            return "", ""
+            return None
+    return None
+
+def getLatestVersion(max_retries=3):
+    downloadUrl = ""
+    version = ""
+
+    # One session for all attempts, closed afterwards so no connection pools pile up
+    session = HTMLSession()
+    try:
+        htmlPageText = fetchReleasesPage(session, max_retries)
+    finally:
+        session.close()
+    if htmlPageText is None:
+        return "", ""
 
     # https://releases.mattermost.com/10.9.0/mattermost-team-10.9.0-linux-amd64.tar.gz
     regex = r'https:\/\/releases\.mattermost\.com\/\d+\.\d+\.\d+\/mattermost-team-\d+\.\d+\.\d+-linux-amd64\.tar\.gz'
 
-    try:
-        downloadUrls = re.findall(regex, htmlPageText)
-        if downloadUrls:
-            downloadUrl = downloadUrls[0]
-        else:
-            logging.warning('⚠️ No download URLs found on Mattermost releases page.')
+    with tracing.span('html_parse', 'parse', bytes=len(htmlPageText)):
+        try:
+            downloadUrls = re.findall(regex, htmlPageText)
+            if downloadUrls:
+                downloadUrl = downloadUrls[0]
+            else:
+                logging.warning('⚠️ No download URLs found on Mattermost releases page.')
+                return "", ""
+        except Exception as e:
+            logging.warning(f'⚠️ Failed parsing Mattermost download url: {str(e)}')
             return "", ""
-    except Exception as e:
-        logging.warning(f'⚠️ Failed parsing Mattermost download url: {str(e)}')
-        return "", ""
 
-    try:
-        versions = re.findall(r'\d+\.\d+\.\d+', downloadUrl)
-        if versions:
-            version = versions[0]
-        else:
-            logging.warning('⚠️ No version found in download URL.')
+        try:
+            versions = re.findall(r'\d+\.\d+\.\d+', downloadUrl)
+            if versions:
+                version = versions[0]
+            else:
+                logging.warning('⚠️ No version found in download URL.')
+                return "", ""
+        except Exception as e:
+            logging.warning(f'⚠️ Failed parsing Mattermost version information: {str(e)}')
             return "", ""
-    except Exception as e:
-        logging.warning(f'⚠️ Failed parsing Mattermost version information: {str(e)}')
-        return "", ""
     
-    logging.info('Latest Mattermost version from releases.mattermost.com: ' + version)
+    logging.info(f'Latest Mattermost version from {RELEASES_URL}: {version}')
     return downloadUrl, version
 
 def readLastversion(enum):
@@ -136,31 +169,31 @@ def readLastversion(enum):
     # https://forum.mattermost.com/t/how-to-get-mattermost-version-via-rest-api/15022
     filename = './data/lastnotifiedversion{enum}.txt'.format(enum = enum)
     try:
-        with open(filename, 'r') as file:
+        with tracing.span('state_read', 'io', file=filename), open(filename, 'r') as file:
             result = file.read().rstrip()
             return result
     except FileNotFoundError:
-        logging.warning(f'⚠️ File not found: {filename}')
+        logging.warning('⚠️ File not found: %s', filename)
         return "0.0.0"
     except PermissionError:
-        logging.warning(f'⚠️ Permission denied reading file: {filename}')
+        logging.warning('⚠️ Permission denied reading file: %s', filename)
         return "0.0.0"
     except Exception as e:
-        logging.warning(f'⚠️ Failed to read file {filename}: {str(e)}')
+        logging.warning('⚠️ Failed to read file %s: %s', filename, e)
         return "0.0.0"
 
 def writeLastversion(enum, version):
     filename = './data/lastnotifiedversion{enum}.txt'.format(enum = enum)
     try:
-        with open(filename, 'w') as file:
+        with tracing.span('state_write', 'io', file=filename), open(filename, 'w') as file:
             file.write(version)
-        logging.debug(f'✅ Written version {version} to {filename}')
+        logging.debug('✅ Written version %s to %s', version, filename)
     except PermissionError:
-        logging.error(f'❌ Permission denied writing file: {filename}')
+        logging.error('❌ Permission denied writing file: %s', filename)
     except OSError as e:
-        logging.error(f'❌ OS error writing file {filename}: {str(e)}')
+        logging.error('❌ OS error writing file %s: %s', filename, e)
     except Exception as e:
-        logging.error(f'❌ Failed to write file {filename}: {str(e)}')
+        logging.error('❌ Failed to write file %s: %s', filename, e)
 
 def isNewer(latestVersion, lastVerion):
     try:
@@ -183,7 +216,9 @@ def sendMM(url, text):
     escaped_text = text.replace('"', '\\"').replace('\n', '\\n').replace('\r', '\\r')
     values = '{ "text": "' + escaped_text + '"}'
     try:
-        response = requests.post(url, headers=headers, data=values, timeout=30)
+        with tracing.span('notify_post', 'http'):
+            response = requests.post(url, headers=headers, data=values, timeout=30)
+            tracing.requestSpans(response, status=response.status_code)
         response.raise_for_status()
         return response.status_code
     except requests.exceptions.RequestException as e:
@@ -193,20 +228,69 @@ def sendMM(url, text):
         logging.warning(f"⚠️ Unexpected error sending notification to {url}: {str(e)}")
         return None
     
-def timer_thread():
-    index = 0
+def checkInstance(index, instance, url, ver, lease=None):
+    """Probe one instance and notify it if needed; returns (outcome, installed version, latency)
+
+    In cluster mode lease() renews this worker's claim on the instance and must
+    succeed before a notification is sent.
+    """
+    started = time.perf_counter()
+    installedVersion = getInstanceVersion(instance['api'])
+    latency = time.perf_counter() - started
+    
+    if not installedVersion:
+        logging.warning('⚠️ Could not determine version for instance %s, skipping.', instance['name'])
+        return 'unreachable', None, latency
+    
+    logging.log(jsonlog.DETAIL, '✅ Instance %s version: %s', instance['name'], installedVersion)
+    
+    # Create new file if not exists
+    if not exists('./data/lastnotifiedversion' + str(index) + '.txt'):
+        writeLastversion(str(index), '0.0.0')
+
+    if not isNewer(ver, installedVersion):
+        logging.log(jsonlog.DETAIL, '✅ Nothing to do (instance is up-to-date).')
+        return 'up_to_date', installedVersion, latency
+
+    logging.log(jsonlog.DETAIL, '🆕 New Mattermost version found, information updated:')
+    logging.log(jsonlog.DETAIL, '📊 Former version: %s', installedVersion)
+    logging.log(jsonlog.DETAIL, '📊 Latest version: %s', ver)
+    logging.log(jsonlog.DETAIL, '📊 Download URL: %s', url)
+    notifiedversion = readLastversion(str(index))
+    logging.log(jsonlog.DETAIL, '📊 Last version notified about: %s', notifiedversion)
+    if not isNewer(ver, notifiedversion):
+        logging.log(jsonlog.DETAIL, 'ℹ️ Update available, but user has been notified already.')
+        return 'already_notified', installedVersion, latency
+
+    if lease and not lease():
+        logging.warning('⚠️ Lost the cluster lease on instance %s, leaving the notification to its new owner.', instance['name'])
+        return 'lease_lost', installedVersion, latency
+
+    text = f'New Mattermost version found!\nLatest version: {ver}\nFormer version: {installedVersion}\nDownload URL: {url}\n[Release notes](https://docs.mattermost.com/about/mattermost-v10-changelog.html)\n'
+    result = sendMM(url=instance['url'], text=text)
+    if not result:
+        logging.warning('⚠️ Failed to send notification, not updating notified version.')
+        return 'notify_failed', installedVersion, latency
+    writeLastversion(str(index), ver)
+    logging.info('📤 Message sent successfully: HTTP %s', result)
+    return 'notified', installedVersion, latency
+
+def timer_thread(cluster=None):
+    cluster = cluster or CLUSTER
     successful_checks = 0
     failed_checks = 0
     
     logging.info('Parsing Mattermost website for latest version and download link.')
-    url, ver = getLatestVersion()
+    with tracing.span('release_fetch'):
+        url, ver = getLatestVersion()
     
     if not ver or not url:
         logging.error('❌ Failed to get latest Mattermost version, skipping this check cycle.')
         return
     
     logging.info('Reading instances from configuration file.')
-    instances = readinstances()
+    with tracing.span('read_instances', 'io'):
+        instances = readinstances()
     
     if not instances:
         logging.error('❌ No valid instances found, skipping this check cycle.')
@@ -214,64 +298,95 @@ def timer_thread():
     
     logging.info(f'📋 Found {len(instances)} instances to check')
     
-    for instance in instances:
-        index += 1
-        
-        logging.info(f'🔍 Checking instance {index}/{len(instances)}: {instance["name"]}')
-        installedVersion = getInstanceVersion(instance['api'])
-        
-        if not installedVersion:
-            logging.warning(f'⚠️ Could not determine version for instance {instance["name"]}, skipping.')
-            failed_checks += 1
-            continue
-        
-        successful_checks += 1
-        logging.info(f'✅ Instance {instance["name"]} version: {installedVersion}')
+    # The index (1-based position in instances.json) keys the lastnotifiedversion files
+    queue = list(enumerate(instances, start=1))
+    if cluster:
+        # Own hash share first, then whatever other workers have not claimed yet
+        with tracing.span('cluster_plan'):
+            slot, keys = cluster.plan([instance['name'] for instance in instances])
+        byName = {instance['name']: (index, instance) for index, instance in queue}
+        queue = [byName[key] for key in keys]
+    
+    for index, instance in queue:
+        lease = None
+        if cluster:
+            # A cycle that overran its interval stops; the next interval belongs to the next cycle
+            if cluster.currentSlot() != slot:
+                logging.warning('⚠️ Cluster: check interval %d ended before the cycle finished, '
+                                'leaving the remaining instances to the next cycle', slot)
+                break
+            # Claim right before probing, so a lease only has to cover one instance
+            if not cluster.claim(instance['name'], slot):
+                continue
+            lease = lambda name=instance['name']: cluster.renew(name, slot)
         
-        # Create new file if not exists
-        if not exists('./data/lastnotifiedversion' + str(index) + '.txt'):
-            writeLastversion(str(index), '0.0.0')
-
-        if isNewer(ver, installedVersion):
-            logging.info('🆕 New Mattermost version found, information updated:')
-            logging.info(f'📊 Former version: {installedVersion}')
-            logging.info(f'📊 Latest version: {ver}')
-            logging.info(f'📊 Download URL: {url}')
-            notifiedversion = readLastversion(str(index))
-            logging.info(f'📊 Last version notified about: {notifiedversion}')
-            if isNewer(ver, notifiedversion):
-                text = f'New Mattermost version found!\nLatest version: {ver}\nFormer version: {installedVersion}\nDownload URL: {url}\n[Release notes](https://docs.mattermost.com/about/mattermost-v10-changelog.html)\n'
-                result = sendMM(url=instance['url'], text=text)
-                if result:
-                    writeLastversion(str(index), ver)
-                    logging.info(f'📤 Message sent successfully: HTTP {result}')
-                else:
-                    logging.warning('⚠️ Failed to send notification, not updating notified version.')
+        logging.log(jsonlog.DETAIL, '🔍 Checking instance %d/%d: %s', index, len(instances), instance['name'])
+        try:
+            with tracing.lane(index, instance['name']), tracing.span('instance', 'instance') as spanArgs:
+                outcome, installedVersion, latency = checkInstance(index, instance, url, ver, lease)
+                spanArgs['outcome'] = outcome
+                jsonlog.logProbe(index, instance['name'], outcome, latency, installedVersion, ver)
+                if EVENTS:
+                    with tracing.span('event_log', 'io'):
+                        EVENTS.record(index, instance['name'], outcome, latency, installedVersion, ver)
+            if outcome == 'unreachable':
+                failed_checks += 1
             else:
-                logging.info('ℹ️ Update available, but user has been notified already.')
-        else:
-            logging.info('✅ Nothing to do (instance is up-to-date).')
+                successful_checks += 1
+        finally:
+            if cluster:
+                cluster.complete(instance['name'], slot)
+    
+    if EVENTS:
+        with tracing.span('event_prune', 'io'):
+            EVENTS.prune()
     
     logging.info(f'📈 Check cycle completed: {successful_checks} successful, {failed_checks} failed')
     logging.info(f'💤 Sleeping for {round(INTERVAL/60)} minutes...')
+    jsonlog.reportDropped()
     return
 
-def CheckForUpdate(scheduler): 
-    # schedule the next call first
-    scheduler.enter(INTERVAL, 1, CheckForUpdate, (scheduler,))
-    logging.info("Scheduler: Starting update check...")
+def runCycle(traced=False, cluster=None):
+    if traced:
+        tracing.begin()
     try:
-        timer_thread()
+        with tracing.span('cycle'):
+            timer_thread(cluster)
     except Exception as e:
         logging.error(f"❌ Unexpected error in update check cycle: {str(e)}")
         logging.info("Continuing with next scheduled check...")
+    finally:
+        if traced:
+            tracing.finish()
+
+def CheckForUpdate(scheduler): 
+    global TRACE_NEXT_CYCLE
+    # schedule the next call first
+    if CLUSTER:
+        # Align to the interval boundaries, so drift never makes a worker skip an interval
+        scheduler.enterabs(CLUSTER.nextSlotStart() + 1, 1, CheckForUpdate, (scheduler,))
+    else:
+        scheduler.enter(INTERVAL, 1, CheckForUpdate, (scheduler,))
+    logging.info("Scheduler: Starting update check...")
+    traced, TRACE_NEXT_CYCLE = tracing.TRACE_CYCLES or TRACE_NEXT_CYCLE, False
+    runCycle(traced=traced)
+
+def WatchTraceTrigger(scheduler):
+    global TRACE_NEXT_CYCLE
+    # Picks up one-off profiled cycles requested from the web interface
+    scheduler.enter(tracing.TRACE_POLL_INTERVAL, 2, WatchTraceTrigger, (scheduler,))
+    if tracing.triggered():
+        if CLUSTER:
+            # An extra cycle would find every instance of the slot already claimed
+            TRACE_NEXT_CYCLE = True
+            logging.info("🧭 Profiled check cycle requested, tracing the next scheduled update check")
+        else:
+            logging.info("🧭 Profiled check cycle requested, starting traced update check...")
+            runCycle(traced=True)
 
 if __name__ == "__main__":
-    # Configure logging with more detailed format
-    logging.basicConfig(
-        format = '%(asctime)s %(levelname)-8s [%(filename)s:%(lineno)d] %(message)s',
-        level = logging.INFO,
-        datefmt = '%Y-%m-%d %H:%M:%S')
+    # Configure logging (text by default, JSON lines with LOG_FORMAT=json)
+    jsonlog.setupLogging(logging.INFO)
     
     logging.info('🚀 Starting Mattermost update checker')
     logging.info(f'📊 Check interval: {INTERVAL} seconds ({INTERVAL/60:.1f} minutes)')
@@ -293,14 +408,29 @@ if __name__ == "__main__":
         logging.error('❌ Instances configuration file ./data/instances.json does not exist!')
         exit(1)
     
+    if cluster.CLUSTER_MODE:
+        CLUSTER = cluster.Cluster(cluster.createStore(), INTERVAL)
+        CLUSTER.start()
+        logging.info('🔗 Cluster mode enabled: worker %s, lease TTL %d seconds', CLUSTER.worker, CLUSTER.ttl)
+    
+    if events.EVENT_LOG:
+        try:
+            EVENTS = events.EventStore()
+            logging.info(f'📡 Recording probe events to {EVENTS.path}')
+        except Exception as e:
+            logging.warning(f'⚠️ Could not open event log, continuing without it: {str(e)}')
+    
     my_scheduler = sched.scheduler(time.time, time.sleep)
     logging.info('⏰ Scheduler initialized, starting first check in 10 seconds...')
     my_scheduler.enter(10, 1, CheckForUpdate, (my_scheduler,))
+    my_scheduler.enter(tracing.TRACE_POLL_INTERVAL, 2, WatchTraceTrigger, (my_scheduler,))
     
     try:
         my_scheduler.run()
     except KeyboardInterrupt:
         logging.info('🛑 Received interrupt signal, shutting down gracefully...')
+        if CLUSTER:
+            CLUSTER.shutdown()
     except Exception as e:
         logging.error(f'❌ Fatal error in scheduler: {str(e)}')
         exit(1)
\ No newline at end of file
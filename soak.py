@@ -0,0 +1,365 @@
+#!/bin/python3
+"""
+Mattermost Update Notifier - Soak test
+
+Runs the update check cycle (main.runCycle) in a tight loop against a local
+mock of the releases page, the instance APIs and the notification webhooks,
+and samples RSS, open file descriptors, thread count and tracemalloc after
+every cycle. Fails (exit code 1) when the growth after the warm-up cycles
+crosses the configured thresholds, so leaks are caught before they run a
+long-lived container out of memory.
+
+    python soak.py --cycles 200 --instances 50
+
+Everything runs in a temporary directory; ./data is not touched.
+
+--json-logs runs the checker with LOG_FORMAT=json (queue handler and listener
+thread, output discarded unless --verbose), --event-webhook posts the state
+changes of flapping instances to a mock event webhook and checks that every
+recorded change was delivered.
+
+With --cluster two clustered workers run every cycle concurrently on one
+SQLite lease store, next to a simulated dead, a live and a finished worker
+claim, and the test also fails if an instance is not probed exactly once per
+interval (or a claimed one is probed at all). At the end one worker's cycle
+overruns the interval boundary, and no instance may be probed twice in either
+interval or notified twice.
+"""
+
+import os
+import gc
+import sys
+import json
+import time
+import logging
+import argparse
+import tempfile
+import threading
+import tracemalloc
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    """Releases page, instance APIs (/api/<n>) and webhooks (/hooks/<n>)"""
+
+    def do_GET(self):
+        if self.path == '/releases':
+            # A new minor release every cycle, so every cycle also sends notifications
+            latest = f'10.{self.server.release}.0'
+            body = (f'<html><body><a href="https://releases.mattermost.com/{latest}/'
+                    f'mattermost-team-{latest}-linux-amd64.tar.gz">{latest}</a></body></html>')
+            self.respond(200, body, 'text/html')
+        elif self.path.startswith('/api/'):
+            n = int(self.path.split('/')[2])
+            with self.server.lock:
+                self.server.probes[n] += 1
+                if self.server.onProbe:
+                    self.server.onProbe(n)
+            # With --event-webhook these instances flap every cycle, so state changes are posted
+            if n % 5 == 0 and (not self.server.flap or self.server.release % 2):
+                # Malformed answer: exercises the error path without retry backoff
+                self.respond(200, json.dumps({'BuildNumber': 'dev'}))
+            else:
+                self.respond(200, json.dumps({'Version': '10.0.0' if n % 2 else '99.0.0'}))
+        else:
+            self.respond(404, '{}')
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        with self.server.lock:
+            self.server.posts[self.path] += 1
+        self.respond(200, 'ok', 'text/plain')
+
+    def respond(self, status, body, contentType='application/json'):
+        data = body.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', contentType)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def rssBytes():
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        # Peak instead of current RSS where /proc is not available
+        import resource
+        scale = 1 if sys.platform == 'darwin' else 1024
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale
+
+
+def fdCount():
+    for directory in ('/proc/self/fd', '/dev/fd'):
+        try:
+            return len(os.listdir(directory))
+        except OSError:
+            continue
+    return 0
+
+
+def sample():
+    gc.collect()
+    return {
+        'rss': rssBytes(),
+        'fds': fdCount(),
+        'threads': threading.active_count(),
+        'traced': tracemalloc.get_traced_memory()[0],
+    }
+
+
+def takeSnapshot():
+    # Leave out the bookkeeping of tracemalloc itself
+    return tracemalloc.take_snapshot().filter_traces([tracemalloc.Filter(False, tracemalloc.__file__)])
+
+
+def parseArgs(argv=None):
+    parser = argparse.ArgumentParser(description='Soak test for the update check cycle')
+    parser.add_argument('--cycles', type=int, default=100, help='measured check cycles (default: 100)')
+    parser.add_argument('--warmup', type=int, default=5, help='cycles before the baseline is taken (default: 5)')
+    parser.add_argument('--instances', type=int, default=20, help='mock instances (default: 20)')
+    parser.add_argument('--interval', type=float, default=0.0, help='pause between cycles in seconds (default: 0)')
+    parser.add_argument('--max-rss-growth', type=float, default=20.0, help='allowed RSS growth in MB (default: 20)')
+    parser.add_argument('--max-traced-growth', type=float, default=5.0, help='allowed tracemalloc growth in MB (default: 5)')
+    parser.add_argument('--max-fd-growth', type=int, default=5, help='allowed growth of open file descriptors (default: 5)')
+    parser.add_argument('--max-thread-growth', type=int, default=2, help='allowed growth of the thread count (default: 2)')
+    parser.add_argument('--top', type=int, default=10, help='tracemalloc allocation sites to report (default: 10)')
+    parser.add_argument('--trace', action='store_true', help='trace every cycle (exercises tracing.py)')
+    parser.add_argument('--cluster', action='store_true', help='run two clustered workers and check exactly-once probing')
+    parser.add_argument('--json-logs', action='store_true', help='log with LOG_FORMAT=json (exercises the log queue listener)')
+    parser.add_argument('--event-webhook', action='store_true', help='post state changes to a mock event webhook')
+    parser.add_argument('--verbose', action='store_true', help='show the log output of the checker')
+    args = parser.parse_args(argv)
+    if args.cycles < 1:
+        parser.error('--cycles must be at least 1')
+    if args.warmup < 0:
+        parser.error('--warmup must not be negative')
+    if args.instances < 1:
+        parser.error('--instances must be at least 1')
+    if args.cluster and args.trace:
+        parser.error('--trace cannot be combined with --cluster (tracing is per process)')
+    if args.cluster and args.instances < 3:
+        parser.error('--cluster needs at least 3 instances')
+    return args
+
+
+def runClusterCycle(checker, workers, store, server, slot, instances):
+    """Run all workers concurrently for one interval; returns the exactly-once violations"""
+    # Simulated third worker: instance 1 is held by a live lease, instance 2 by a
+    # worker that died mid-probe (lease already expired), instance 3 is already done
+    store.claim('soak-1', slot, 'ghost', 10**9, slot * workers[0].interval)
+    store.claim('soak-2', slot, 'ghost', 0, slot * workers[0].interval)
+    store.claim('soak-3', slot, 'ghost', 10**9, slot * workers[0].interval)
+    store.complete('soak-3', slot, 'ghost')
+
+    threads = [threading.Thread(target=checker.runCycle, kwargs={'cluster': worker}) for worker in workers]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    errors = []
+    for n in range(1, instances + 1):
+        expected = 0 if n in (1, 3) else 1
+        if server.probes[n] != expected:
+            errors.append(f'soak-{n} probed {server.probes[n]}x (expected {expected})')
+        if server.posts[f'/hooks/{n}'] > 1:
+            errors.append(f'soak-{n} notified {server.posts[f"/hooks/{n}"]}x')
+    return errors
+
+
+def runOverrunCheck(checker, workers, server, now, instances):
+    """Let one worker's cycle run past the interval boundary; returns the violations
+
+    The fake clock moves into the next interval halfway through the probes of
+    the first worker. Afterwards both workers run the next interval; every
+    instance must be probed at most once per interval and notified at most once.
+    """
+    import cluster
+    interval = workers[0].interval
+    now[0] = (cluster.slotFor(interval, now[0]) + 1) * interval
+    slots = Counter()
+
+    def onProbe(n):
+        slots[(n, cluster.slotFor(interval, now[0]))] += 1
+        if sum(slots.values()) == instances // 2:
+            now[0] += interval
+
+    server.probes.clear()
+    server.posts.clear()
+    server.onProbe = onProbe
+    try:
+        checker.runCycle(cluster=workers[0])
+        threads = [threading.Thread(target=checker.runCycle, kwargs={'cluster': worker}) for worker in workers]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    finally:
+        server.onProbe = None
+
+    last = cluster.slotFor(interval, now[0])
+    errors = [f'overrun: soak-{n} probed {count}x in interval {slot}'
+              for (n, slot), count in sorted(slots.items()) if count > 1]
+    errors += [f'overrun: soak-{n} not probed in interval {last}'
+               for n in range(1, instances + 1) if not slots[(n, last)]]
+    errors += [f'overrun: soak-{n} notified {server.posts[f"/hooks/{n}"]}x'
+               for n in range(1, instances + 1) if server.posts[f'/hooks/{n}'] > 1]
+    return errors
+
+
+def main(argv=None):
+    args = parseArgs(argv)
+    # The report has its own handler, so it stays readable whatever the checker logs
+    report = logging.getLogger('soak')
+    report.setLevel(logging.INFO)
+    report.propagate = False
+    output = logging.StreamHandler()
+    output.setFormatter(logging.Formatter('%(asctime)s %(levelname)-8s [%(filename)s:%(lineno)d] %(message)s',
+                                          '%Y-%m-%d %H:%M:%S'))
+    report.addHandler(output)
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), MockHandler)
+    server.daemon_threads = True
+    server.release = 1
+    server.lock = threading.Lock()
+    server.probes = Counter()
+    server.posts = Counter()
+    server.flap = args.event_webhook
+    server.onProbe = None
+    base = f'http://127.0.0.1:{server.server_address[1]}'
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    workdir = tempfile.TemporaryDirectory(prefix='mm-soak-')
+    os.chdir(workdir.name)
+    os.makedirs('./data')
+    with open('./data/instances.json', 'w') as f:
+        json.dump([{'name': f'soak-{n}', 'api': f'{base}/api/{n}', 'url': f'{base}/hooks/{n}', 'channel': ''}
+                   for n in range(1, args.instances + 1)], f)
+
+    # The checker reads its configuration at import time
+    os.environ['RELEASES_URL'] = f'{base}/releases'
+    os.environ['TRACE_DIR'] = './data/traces'
+    if args.json_logs:
+        os.environ['LOG_FORMAT'] = 'json'
+    if args.event_webhook:
+        os.environ['EVENT_WEBHOOK_URL'] = f'{base}/events'
+    tracemalloc.start()
+    import main as checker
+    import events
+    import jsonlog
+    checker.EVENTS = events.EventStore('./data/events.db')
+
+    # Started before the baseline, so the listener thread is not counted as growth
+    listener = jsonlog.setupLogging(logging.INFO if args.verbose or args.json_logs else logging.ERROR)
+    if listener and not args.verbose:
+        # Left open: the listener is stopped at exit and reports dropped records to it
+        devnull = open(os.devnull, 'w')
+        for handler in listener.handlers:
+            handler.setStream(devnull)
+    eventPosts = 0
+
+    workers = []
+    if args.cluster:
+        import cluster
+        store = cluster.SQLiteLeaseStore('./data/cluster.db')
+        # Fake clock: every soak cycle is a new check interval
+        now = [time.time()]
+        workers = [cluster.Cluster(store, checker.INTERVAL, worker=name, clock=lambda: now[0])
+                   for name in ('soak-a', 'soak-b')]
+        for worker in workers:
+            worker.start()
+    clusterErrors = []
+
+    report.info(f'🧪 Soak test: {args.warmup} warm-up + {args.cycles} measured cycles, '
+                f'{args.instances} instances, mock server {base}, data in {workdir.name}')
+
+    baseline = None
+    # Snapshots are compared every cycle; start during warm-up so their own memory is in the baseline
+    snapshot = takeSnapshot()
+    for cycle in range(args.warmup + args.cycles):
+        started = time.perf_counter()
+        if workers:
+            now[0] += checker.INTERVAL
+            slot = cluster.slotFor(checker.INTERVAL, now[0])
+            clusterErrors += [f'cycle {cycle + 1}: {error}' for error in
+                              runClusterCycle(checker, workers, store, server, slot, args.instances)]
+        else:
+            checker.runCycle(traced=args.trace)
+        duration = time.perf_counter() - started
+        server.release += 1
+        eventPosts += server.posts['/events']
+        server.probes.clear()
+        server.posts.clear()
+        resources = sample()
+        current = takeSnapshot()
+        stats = current.compare_to(snapshot, 'lineno')
+        top = f', top growth {stats[0]}' if stats else ''
+        del stats
+        if cycle == args.warmup - 1 or (args.warmup == 0 and cycle == 0):
+            baseline = resources
+            snapshot = current
+        del current
+        report.info(f'🔁 Cycle {cycle + 1}: {duration:.2f}s, '
+                    f'RSS {resources["rss"] / 2**20:.1f} MB, fds {resources["fds"]}, '
+                    f'threads {resources["threads"]}, traced {resources["traced"] / 2**20:.2f} MB{top}')
+        if args.interval:
+            time.sleep(args.interval)
+
+    growth = {key: resources[key] - baseline[key] for key in resources}
+    limits = {
+        'rss': args.max_rss_growth * 2**20,
+        'traced': args.max_traced_growth * 2**20,
+        'fds': args.max_fd_growth,
+        'threads': args.max_thread_growth,
+    }
+
+    report.info(f'📊 Top {args.top} allocation sites by growth since baseline:')
+    for stat in takeSnapshot().compare_to(snapshot, 'lineno')[:args.top]:
+        report.info(f'   {stat}')
+
+    failed = [key for key in limits if growth[key] > limits[key]]
+    for key in limits:
+        value = growth[key] / 2**20 if key in ('rss', 'traced') else growth[key]
+        limit = limits[key] / 2**20 if key in ('rss', 'traced') else limits[key]
+        unit = ' MB' if key in ('rss', 'traced') else ''
+        status = '❌' if key in failed else '✅'
+        report.info(f'{status} {key} growth: {value:.2f}{unit} (limit {limit:.2f}{unit})')
+
+    if args.event_webhook:
+        changes = len([event for event in checker.EVENTS.read(limit=10**9) if event['kind'] != 'probe'])
+        status = '✅' if changes and eventPosts == changes else '❌'
+        report.info(f'{status} event webhook: {eventPosts} posts for {changes} recorded state changes')
+        if status == '❌':
+            failed.append('event webhook')
+
+    if workers:
+        clusterErrors += runOverrunCheck(checker, workers, server, now, args.instances)
+        for error in clusterErrors[:args.top]:
+            report.info(f'   {error}')
+        status = '❌' if clusterErrors else '✅'
+        report.info(f'{status} cluster: {len(clusterErrors)} exactly-once violations (including interval overrun)')
+        if clusterErrors:
+            failed.append('cluster')
+        for worker in workers:
+            worker.shutdown()
+
+    server.shutdown()
+    server.server_close()
+    os.chdir('/')
+    workdir.cleanup()
+
+    if failed:
+        report.error(f'❌ Soak test failed: {", ".join(failed)}')
+        return 1
+    report.info('✅ Soak test passed: memory, file descriptors and threads stayed flat')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
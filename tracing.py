@@ -0,0 +1,186 @@
+#!/bin/python3
+"""
+Mattermost Update Notifier - Cycle tracing
+
+Opt-in tracing of check cycles. While a cycle is traced every phase (release
+fetch, HTML parsing, instance probes with their retries and backoff sleeps,
+notification posts, state file reads/writes) is recorded as a span, and the
+result is written to ./data/traces in Chrome trace event format, which can be
+opened in chrome://tracing, Perfetto or speedscope. Each instance gets its
+own lane (tid) in the trace.
+
+Tracing is enabled for every cycle with TRACE_CYCLES=true, or for a single
+cycle by creating the trigger file (the web interface does this).
+"""
+
+import os
+import json
+import time
+import logging
+from contextlib import contextmanager, nullcontext
+from datetime import datetime
+
+TRACE_CYCLES = os.environ.get('TRACE_CYCLES', '').lower() in ('1', 'true', 'yes', 'on')
+TRACE_DIR = os.environ.get('TRACE_DIR', './data/traces')
+TRIGGER_FILE = os.environ.get('TRACE_TRIGGER_FILE', './data/trace_next_cycle')
+
+try:
+    TRACE_POLL_INTERVAL = int(os.environ['TRACE_POLL_INTERVAL'])
+except:
+    TRACE_POLL_INTERVAL = 10
+
+try:
+    TRACE_KEEP = int(os.environ['TRACE_KEEP'])
+except:
+    TRACE_KEEP = 20
+
+
+class Tracer:
+    """Collects complete ('X') trace events for one cycle"""
+
+    def __init__(self):
+        self.events = []
+        self.pid = os.getpid()
+        self.tid = 0
+        self.open = []
+        self.lanes = {0: 'cycle'}
+        self.origin = time.perf_counter()
+        self.started = datetime.now()
+
+    def _us(self, t):
+        return round((t - self.origin) * 1e6, 1)
+
+    def add(self, name, start, end, cat='cycle', tid=None, **args):
+        self.events.append({
+            'name': name,
+            'cat': cat,
+            'ph': 'X',
+            'ts': self._us(start),
+            'dur': round((end - start) * 1e6, 1),
+            'pid': self.pid,
+            'tid': self.tid if tid is None else tid,
+            'args': args,
+        })
+
+    @contextmanager
+    def span(self, name, cat='cycle', **args):
+        start = time.perf_counter()
+        # Start times of the open spans, so child spans can be placed inside them
+        self.open.append(start)
+        try:
+            yield args
+        except BaseException as e:
+            args['error'] = repr(e)
+            raise
+        finally:
+            self.open.pop()
+            self.add(name, start, time.perf_counter(), cat, **args)
+
+    def save(self, directory=TRACE_DIR):
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, 'trace-' + self.started.strftime('%Y%m%d-%H%M%S') + '.json')
+        metadata = [{'name': 'process_name', 'ph': 'M', 'pid': self.pid, 'args': {'name': 'update-checker'}}]
+        metadata += [{'name': 'thread_name', 'ph': 'M', 'pid': self.pid, 'tid': tid,
+                      'args': {'name': name}} for tid, name in sorted(self.lanes.items())]
+        with open(path, 'w') as f:
+            json.dump({'traceEvents': metadata + self.events, 'displayTimeUnit': 'ms'}, f)
+        return path
+
+
+_active = None
+
+
+def span(name, cat='cycle', **args):
+    """Record a span in the active trace; a no-op context when no cycle is traced"""
+    if _active is None:
+        return nullcontext(args)
+    return _active.span(name, cat, **args)
+
+
+@contextmanager
+def lane(tid, name):
+    """Put the spans of one instance on their own lane"""
+    if _active is None:
+        yield
+        return
+    previous = _active.tid
+    _active.tid = tid
+    _active.lanes[tid] = name
+    try:
+        yield
+    finally:
+        _active.tid = previous
+
+
+def requestSpans(response, cat='http', **args):
+    """Split the enclosing request span into time-to-first-byte and body spans
+
+    Call inside the span around the requests call, right after it returned, so
+    the sub-spans start with that span and nest inside it. requests does not
+    expose DNS/connect/TLS timings separately; the time until the response
+    headers were parsed (response.elapsed) covers all of them.
+    """
+    if _active is None or response is None or not _active.open:
+        return
+    started = _active.open[-1]
+    ended = time.perf_counter()
+    ttfb = min(response.elapsed.total_seconds(), ended - started)
+    _active.add('connect+ttfb', started, started + ttfb, cat, **args)
+    _active.add('body', started + ttfb, ended, cat, bytes=len(response.content), **args)
+
+
+def begin():
+    global _active
+    _active = Tracer()
+    return _active
+
+
+def finish():
+    """Write the active trace to TRACE_DIR and stop tracing"""
+    global _active
+    tracer, _active = _active, None
+    if tracer is None:
+        return None
+    try:
+        path = tracer.save()
+        prune()
+        logging.info(f'🧭 Cycle trace written to {path} ({len(tracer.events)} spans)')
+        return path
+    except Exception as e:
+        logging.warning(f'⚠️ Failed to write cycle trace: {str(e)}')
+        return None
+
+
+def prune(directory=TRACE_DIR, keep=TRACE_KEEP):
+    traces = sorted(f for f in os.listdir(directory) if f.startswith('trace-') and f.endswith('.json'))
+    for name in traces[:-keep] if keep > 0 else []:
+        os.remove(os.path.join(directory, name))
+
+
+def requestTrace():
+    """Ask the update checker to trace its next cycle (used by the web interface)"""
+    directory = os.path.dirname(TRIGGER_FILE)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(TRIGGER_FILE, 'w') as f:
+        f.write(datetime.now().isoformat())
+
+
+def triggered():
+    """True (once) if a traced cycle was requested"""
+    try:
+        os.remove(TRIGGER_FILE)
+        return True
+    except FileNotFoundError:
+        return False
+    except OSError as e:
+        logging.warning(f'⚠️ Could not remove trace trigger file {TRIGGER_FILE}: {str(e)}')
+        return False
+
+
+def listTraces(directory=TRACE_DIR):
+    try:
+        return sorted((f for f in os.listdir(directory) if f.startswith('trace-') and f.endswith('.json')),
+                      reverse=True)
+    except FileNotFoundError:
+        return []
@@ -5,17 +5,22 @@ Mattermost Update Notifier - Admin Web Interface
 
 import os
 import json
+import hmac
+import time
 import logging
 import requests
 from datetime import datetime
-from flask import Flask, render_template, request, redirect, url_for, flash, session, jsonify
+from flask import Flask, render_template, request, redirect, url_for, flash, session, jsonify, Response, stream_with_context, abort, send_from_directory
 # Removed Flask-Babel import due to compatibility issues
 from dotenv import load_dotenv
 from packaging import version
 
-# Load environment variables
+# Load environment variables (before events/tracing, they read their settings on import)
 load_dotenv('config.env')
 
+import events
+import tracing
+
 app = Flask(__name__)
 app.secret_key = os.environ.get('SECRET_KEY', 'your-secret-key-change-in-production')
 
@@ -23,6 +28,13 @@ app.secret_key = os.environ.get('SECRET_KEY', 'your-secret-key-change-in-product
 WEB_PORT = int(os.environ.get('WEB_PORT', 5000))
 ADMIN_PASSWORD = os.environ.get('ADMIN_PASSWORD', 'admin123')
 INSTANCES_FILE = './data/instances.json'
+# Token for the read-only event stream (/api/stream); the stream is disabled when empty
+STREAM_TOKEN = os.environ.get('STREAM_TOKEN', '')
+
+try:
+    STREAM_POLL_INTERVAL = float(os.environ['STREAM_POLL_INTERVAL'])
+except:
+    STREAM_POLL_INTERVAL = 2
 
 # Language Configuration
 LANGUAGES = {
@@ -91,6 +103,11 @@ def translate_text(text, lang=None):
             'Go to a channel → Channel Info → Integrations': 'Gehen Sie zu einem Channel → Channel Info → Integrations',
             'Click "Incoming Webhooks" → "Add Incoming Webhook"': 'Klicken Sie auf "Incoming Webhooks" → "Add Incoming Webhook"',
             'Copy the generated webhook URL': 'Kopieren Sie die generierte Webhook-URL',
+            'Profile Next Cycle': 'Nächsten Durchlauf profilieren',
+            'Cycle Traces': 'Durchlauf-Traces',
+            'Open in chrome://tracing, Perfetto or speedscope.': 'Öffnen mit chrome://tracing, Perfetto oder speedscope.',
+            'A profiled check cycle was requested, the trace will appear below when it is finished.': 'Ein profilierter Prüfdurchlauf wurde angefordert, der Trace erscheint unten, sobald er fertig ist.',
+            'Could not request a profiled check cycle!': 'Profilierter Prüfdurchlauf konnte nicht angefordert werden!',
         },
         'en': {
             'Dashboard': 'Dashboard',
@@ -142,6 +159,11 @@ def translate_text(text, lang=None):
             'Go to a channel → Channel Info → Integrations': 'Go to a channel → Channel Info → Integrations',
             'Click "Incoming Webhooks" → "Add Incoming Webhook"': 'Click "Incoming Webhooks" → "Add Incoming Webhook"',
             'Copy the generated webhook URL': 'Copy the generated webhook URL',
+            'Profile Next Cycle': 'Profile Next Cycle',
+            'Cycle Traces': 'Cycle Traces',
+            'Open in chrome://tracing, Perfetto or speedscope.': 'Open in chrome://tracing, Perfetto or speedscope.',
+            'A profiled check cycle was requested, the trace will appear below when it is finished.': 'A profiled check cycle was requested, the trace will appear below when it is finished.',
+            'Could not request a profiled check cycle!': 'Could not request a profiled check cycle!',
         }
     }
     
@@ -232,9 +254,9 @@ def get_latest_version():
     """Get latest Mattermost version from releases page"""
     try:
         from requests_html import HTMLSession
-        session = HTMLSession()
-        r = session.get('https://releases.mattermost.com', timeout=30)
-        r.raise_for_status()
+        with HTMLSession() as session:
+            r = session.get(os.environ.get('RELEASES_URL', 'https://releases.mattermost.com'), timeout=30)
+            r.raise_for_status()
         
         # Parse version from download URLs
         import re
@@ -283,7 +305,28 @@ def index():
     
     return render_template('dashboard.html', 
                          instances=instance_statuses, 
-                         latest_version=latest_version)
+                         latest_version=latest_version,
+                         traces=tracing.listTraces()[:10])
+
+@app.route('/trace', methods=['POST'])
+@require_auth
+def trace_cycle():
+    """Ask the update checker to run a one-off profiled check cycle"""
+    try:
+        tracing.requestTrace()
+        flash(_('A profiled check cycle was requested, the trace will appear below when it is finished.'), 'success')
+    except Exception as e:
+        logging.error(f'Error requesting traced cycle: {e}')
+        flash(_('Could not request a profiled check cycle!'), 'error')
+    return redirect(url_for('index'))
+
+@app.route('/traces/<path:filename>')
+@require_auth
+def download_trace(filename):
+    """Download a cycle trace file"""
+    if filename not in tracing.listTraces():
+        abort(404)
+    return send_from_directory(os.path.abspath(tracing.TRACE_DIR), filename, as_attachment=True)
 
 @app.route('/login', methods=['GET', 'POST'])
 def login():
@@ -458,6 +501,67 @@ def api_status():
         'timestamp': datetime.now().isoformat()
     })
 
+def require_stream_token(f):
+    """Decorator to require the stream token as Authorization: Bearer header"""
+    from functools import wraps
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        if not STREAM_TOKEN:
+            abort(404)
+        header = request.headers.get('Authorization', '')
+        if not header.startswith('Bearer '):
+            abort(401)
+        token = header[7:]
+        if not hmac.compare_digest(token.encode('utf-8'), STREAM_TOKEN.encode('utf-8')):
+            abort(401)
+        return f(*args, **kwargs)
+    return decorated_function
+
+@app.route('/api/stream')
+@require_stream_token
+def api_stream():
+    """Stream probe results and state changes as NDJSON or Server-Sent Events"""
+    sse = request.args.get('format') == 'sse' or 'text/event-stream' in request.headers.get('Accept', '')
+    # SSE clients resume with Last-Event-ID, everyone else passes ?cursor=<last seen id>
+    try:
+        cursor = int(request.headers.get('Last-Event-ID') or request.args.get('cursor', 0))
+    except ValueError:
+        return jsonify({'error': 'Invalid cursor'}), 400
+    follow = sse or request.args.get('follow', '0') in ('1', 'true', 'yes')
+    kinds = [k for k in request.args.get('kind', '').split(',') if k]
+
+    try:
+        store = events.EventStore()
+    except Exception as e:
+        logging.error(f'Error opening event log: {e}')
+        return jsonify({'error': 'Event log not available'}), 503
+
+    def generate(cursor):
+        idle = 0.0
+        while True:
+            batch = store.read(cursor, kinds=kinds)
+            for event in batch:
+                cursor = event['id']
+                if sse:
+                    yield f'id: {event["id"]}\nevent: {event["kind"]}\ndata: {json.dumps(event)}\n\n'
+                else:
+                    yield json.dumps(event) + '\n'
+            if batch:
+                idle = 0.0
+                continue
+            if not follow:
+                return
+            time.sleep(STREAM_POLL_INTERVAL)
+            idle += STREAM_POLL_INTERVAL
+            if idle >= 15:
+                # Keep proxies from closing an idle connection
+                yield ': keepalive\n\n' if sse else '\n'
+                idle = 0.0
+
+    mimetype = 'text/event-stream' if sse else 'application/x-ndjson'
+    return Response(stream_with_context(generate(cursor)), mimetype=mimetype,
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
 # Make translation function available in templates
 app.jinja_env.globals.update(_=_)
 